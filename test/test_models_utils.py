@@ -33,3 +33,97 @@ def test_yolo_transform():
     # Test annotations after transformation
     torch.testing.assert_allclose(annotations[0]['boxes'], annotations_copy[0]['boxes'], rtol=0., atol=0.)
     torch.testing.assert_allclose(annotations[1]['boxes'], annotations_copy[1]['boxes'], rtol=0., atol=0.)
+
+
+def test_yolo_transform_empty_targets():
+    transform = YOLOTransform(300, 500)
+    images = [torch.rand(3, 200, 300), torch.rand(3, 200, 200)]
+    annotations = [
+        {'boxes': torch.zeros((0, 4)), 'labels': torch.zeros((0,), dtype=torch.int64)},
+        {'boxes': torch.zeros((0, 4)), 'labels': torch.zeros((0,), dtype=torch.int64)},
+    ]
+    samples, targets = transform(images, annotations)
+    assert isinstance(samples, NestedTensor)
+    # The batched targets are empty rather than missing when no image has objects
+    assert tuple(targets.shape) == (0, 6)
+    assert targets.dtype == torch.float32
+
+
+def test_yolo_transform_batched_resize():
+    transform = YOLOTransform(300, 500)
+    transform.eval()
+    images = [torch.rand(3, 200, 300), torch.rand(3, 200, 300)]
+    samples, _ = transform(images)
+    assert isinstance(samples, NestedTensor)
+
+    # Images of the same shape are resized in one go, make sure that it's consistent with
+    # the per-image resizing
+    for image, sample, image_size in zip(images, samples.tensors, samples.image_sizes):
+        image_resized, _ = transform.resize(image)
+        assert tuple(image_resized.shape[-2:]) == image_size
+        h, w = image_size
+        torch.testing.assert_allclose(sample[:, :h, :w], image_resized, rtol=0., atol=0.)
+
+
+def test_yolo_transform_uint8():
+    transform = YOLOTransform(300, 500)
+    transform.eval()
+    # Cover both the batched and the per-image resizing
+    for shapes in [[(200, 300), (200, 300)], [(200, 300), (200, 200)]]:
+        images = [torch.randint(256, (3, h, w), dtype=torch.uint8) for h, w in shapes]
+        samples, _ = transform(images)
+        samples_expected, _ = transform([img.float() / 255. for img in images])
+        assert samples.tensors.dtype == torch.float32
+        assert samples.image_sizes == samples_expected.image_sizes
+        torch.testing.assert_allclose(samples.tensors, samples_expected.tensors)
+
+    # Mixing uint8 and float images of the same shape, only the uint8 images are scaled
+    image_uint8 = torch.randint(256, (3, 200, 300), dtype=torch.uint8)
+    image_float = torch.rand(3, 200, 300)
+    samples, _ = transform([image_uint8, image_float])
+    samples_expected, _ = transform([image_uint8.float() / 255., image_float])
+    assert samples.tensors.max() <= 1.
+    torch.testing.assert_allclose(samples.tensors, samples_expected.tensors)
+
+
+def test_yolo_transform_traced_resize():
+    for min_size, max_size in [(320, 416), ((320, 352, 384), 640)]:
+        transform = YOLOTransform(min_size, max_size)
+        transform.eval()
+
+        def resize_image(image):
+            return transform.resize(image)[0]
+
+        traced_resize = torch.jit.trace(resize_image, torch.rand(3, 100, 120))
+        # The eager resizing must agree with the exported graph, including the sizes
+        # where the scale is rounding sensitive
+        for h, w in [(200, 300), (427, 640), (600, 900), (333, 500)]:
+            image = torch.rand(3, h, w)
+            assert traced_resize(image).shape == resize_image(image).shape
+
+
+def test_yolo_transform_traced_boxes():
+    transform = YOLOTransform(320, 416)
+    transform.eval()
+    boxes = torch.tensor([[10., 20., 100., 150.], [0., 5., 200., 180.]])
+
+    def rescale_boxes(boxes, image, original_image):
+        result = [{'boxes': boxes}]
+        result = transform.postprocess(result, [image.shape[-2:]], [original_image.shape[-2:]])
+        return result[0]['boxes']
+
+    def normalize_target_boxes(boxes, image):
+        _, target = transform.resize(image, {'boxes': boxes})
+        return target['boxes']
+
+    # The sizes are traced at one shape, and must stay dynamic at the other shapes
+    traced_rescale_boxes = torch.jit.trace(
+        rescale_boxes, (boxes, torch.rand(3, 320, 416), torch.rand(3, 200, 300)))
+    traced_normalize_target_boxes = torch.jit.trace(
+        normalize_target_boxes, (boxes, torch.rand(3, 200, 300)))
+
+    image, original_image = torch.rand(3, 288, 416), torch.rand(3, 480, 640)
+    torch.testing.assert_allclose(traced_rescale_boxes(boxes, image, original_image),
+                                  rescale_boxes(boxes, image, original_image))
+    torch.testing.assert_allclose(traced_normalize_target_boxes(boxes, original_image),
+                                  normalize_target_boxes(boxes, original_image))
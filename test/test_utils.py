@@ -1,13 +1,53 @@
 # Copyright (c) 2021, Zhiqiang Wang. All Rights Reserved.
+import pytest
 import numpy as np
 
+import torch
 from torch import nn, Tensor
 
+from yolort.models import yolo
 from yolort.utils import (
     update_module_state_from_ultralytics,
     read_image_to_tensor,
     get_image_from_url,
 )
+from yolort.utils.update_module_state import ModuleStateUpdate
+
+
+class _Detect(nn.Module):
+    def __init__(self, m):
+        super().__init__()
+        self.m = m
+
+
+class _Model(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+
+def _get_yolov5_like_model(arch):
+    """
+    Build a yolort model with random states, and lay out its modules like the
+    sequential model of ultralytics, see ModuleStateUpdate for the indices
+    """
+    model = yolo.__dict__[arch](num_classes=80)
+    for tensor in model.state_dict().values():
+        if tensor.is_floating_point():
+            tensor.normal_()
+        else:
+            tensor.fill_(7)
+
+    modules = [nn.Identity() for _ in range(25)]
+    for i in range(9):
+        modules[i] = model.backbone.body[str(i)]
+    for i, ind in {0: 9, 1: 10, 3: 13, 4: 14}.items():
+        modules[ind] = model.backbone.pan.inner_blocks[i]
+    for i, ind in {0: 17, 1: 18, 2: 20, 3: 21, 4: 23}.items():
+        modules[ind] = model.backbone.pan.layer_blocks[i]
+    modules[24] = _Detect(model.head.head)
+
+    return model, _Model(nn.Sequential(*modules))
 
 
 def test_update_module_state_from_ultralytics():
@@ -21,6 +61,80 @@ def test_update_module_state_from_ultralytics():
     assert isinstance(model, nn.Module)
 
 
+def test_update_module_state_from_ultralytics_unsupported_arch():
+    # The architecture is checked before the ultralytics model is loaded
+    with pytest.raises(ValueError):
+        update_module_state_from_ultralytics(arch='yolov5x', version='v4.0')
+
+
+def test_update_module_state_from_ultralytics_alias_with_fp16():
+    # The weights can't be shared with the ultralytics model when casting them to fp16
+    with pytest.raises(ValueError):
+        update_module_state_from_ultralytics(arch='yolov5s', version='v4.0', set_fp16=True, alias=True)
+
+
+@pytest.mark.parametrize('arch', [
+    'yolov5_darknet_pan_s_r31',
+    'yolov5_darknet_pan_s_r40',
+    'yolov5_darknet_tan_s_r40',
+])
+def test_module_state_update(arch):
+    model, model_yolov5 = _get_yolov5_like_model(arch)
+    module_state_updater = ModuleStateUpdate(arch=arch, num_classes=80)
+    module_state_updater.updating(model_yolov5)
+
+    state_dict = module_state_updater.model.state_dict()
+    assert list(state_dict) == list(model.state_dict())
+    for name, tensor in model.state_dict().items():
+        assert state_dict[name].dtype == tensor.dtype
+        torch.testing.assert_allclose(state_dict[name], tensor, rtol=0., atol=0.)
+        # The weights are copied rather than shared without asking for aliasing
+        assert state_dict[name].data_ptr() != tensor.data_ptr()
+
+
+def test_module_state_update_alias():
+    model, model_yolov5 = _get_yolov5_like_model('yolov5_darknet_pan_s_r40')
+    module_state_updater = ModuleStateUpdate(arch='yolov5_darknet_pan_s_r40', num_classes=80)
+    module_state_updater.updating(model_yolov5, alias=True)
+
+    state_dict = module_state_updater.model.state_dict()
+    for name, tensor in model.state_dict().items():
+        assert state_dict[name].data_ptr() == tensor.data_ptr()
+    for params in module_state_updater.model.parameters():
+        assert isinstance(params, nn.Parameter)
+        assert params.requires_grad
+
+
+def test_module_state_update_alias_dtype_mismatch():
+    model, model_yolov5 = _get_yolov5_like_model('yolov5_darknet_pan_s_r40')
+    model_yolov5.double()
+    module_state_updater = ModuleStateUpdate(arch='yolov5_darknet_pan_s_r40', num_classes=80)
+    module_state_updater.updating(model_yolov5, alias=True)
+
+    # The memory can't be shared across dtypes, the float weights are copied instead,
+    # while the integer buffers such as num_batches_tracked keep their dtype and are shared
+    state_dict = module_state_updater.model.state_dict()
+    for name, tensor in model.state_dict().items():
+        if tensor.is_floating_point():
+            assert state_dict[name].dtype == torch.float32
+            assert state_dict[name].data_ptr() != tensor.data_ptr()
+        else:
+            assert state_dict[name].data_ptr() == tensor.data_ptr()
+        torch.testing.assert_allclose(state_dict[name], tensor.to(state_dict[name].dtype))
+
+
+def test_module_state_update_alias_shape_mismatch():
+    _, model_yolov5 = _get_yolov5_like_model('yolov5_darknet_pan_s_r40')
+    module_state_updater = ModuleStateUpdate(arch='yolov5_darknet_pan_s_r40', num_classes=20)
+    state_dict = {k: v.clone() for k, v in module_state_updater.model.state_dict().items()}
+    with pytest.raises(RuntimeError, match='size mismatch for head.head.0.weight'):
+        module_state_updater.updating(model_yolov5, alias=True)
+
+    # The shapes are validated before any weights are touched
+    for name, tensor in module_state_updater.model.state_dict().items():
+        torch.testing.assert_allclose(tensor, state_dict[name], rtol=0., atol=0.)
+
+
 def test_read_image_to_tensor():
     N, H, W = 3, 720, 360
     img = np.random.randint(0, 255, (H, W, N), dtype='uint8')  # As a dummy image
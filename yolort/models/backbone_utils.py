@@ -39,7 +39,8 @@ class BackboneWithPAN(nn.Module):
 
     def forward(self, x):
         x = self.body(x)
-        x = self.pan(x)
+        # The PAN takes the feature maps as a list, ordered from highest resolution first
+        x = self.pan(list(x.values()))
         return x
 
 
@@ -163,17 +163,19 @@ class PostProcess(nn.Module):
             all_pred_logits.append(pred_logits)
 
         all_pred_logits = torch.cat(all_pred_logits, dim=1)
+        # Decode the whole batch at once, only the filtering and NMS are done per image
+        all_pred_logits = torch.sigmoid(all_pred_logits)
 
-        detections: List[Dict[str, Tensor]] = []
+        # Compute conf
+        # box_conf x class_conf, w/ shape: batch_size x num_anchors x num_classes
+        all_scores = all_pred_logits[..., 5:] * all_pred_logits[..., 4:5]
 
-        for idx in range(batch_size):  # image idx, image inference
-            pred_logits = torch.sigmoid(all_pred_logits[idx])
+        all_boxes = self.box_coder.decode_single(all_pred_logits[..., :4], anchors_tuple)
 
-            # Compute conf
-            # box_conf x class_conf, w/ shape: num_anchors x num_classes
-            scores = pred_logits[:, 5:] * pred_logits[:, 4:5]
+        detections: List[Dict[str, Tensor]] = []
 
-            boxes = self.box_coder.decode_single(pred_logits[:, :4], anchors_tuple)
+        for idx in range(batch_size):  # image idx, image inference
+            boxes, scores = all_boxes[idx], all_scores[idx]
 
             # remove low scoring boxes
             inds, labels = torch.where(scores > self.score_thresh)
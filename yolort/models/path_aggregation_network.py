@@ -4,7 +4,7 @@ from torch import nn, Tensor
 
 from .common import Conv, BottleneckCSP, C3
 
-from typing import Callable, List, Dict, Optional
+from typing import Callable, List, Optional
 
 
 class PathAggregationNetwork(nn.Module):
@@ -15,8 +15,8 @@ class PathAggregationNetwork(nn.Module):
     The feature maps are currently supposed to be in increasing depth
     order.
 
-    The input to the model is expected to be an OrderedDict[Tensor], containing
-    the feature maps on top of which the PAN will be added.
+    The input to the model is expected to be a list of feature maps, on top of
+    which the PAN will be added.
 
     Args:
         in_channels_list (list[int]): number of channels for each feature map that
@@ -28,17 +28,18 @@ class PathAggregationNetwork(nn.Module):
 
         >>> m = PathAggregationNetwork()
         >>> # get some dummy data
-        >>> x = OrderedDict()
-        >>> x['feat0'] = torch.rand(1, 128, 52, 44)
-        >>> x['feat2'] = torch.rand(1, 256, 26, 22)
-        >>> x['feat3'] = torch.rand(1, 512, 13, 11)
+        >>> x = [
+        >>>     torch.rand(1, 128, 52, 44),
+        >>>     torch.rand(1, 256, 26, 22),
+        >>>     torch.rand(1, 512, 13, 11),
+        >>> ]
         >>> # compute the PAN on top of x
         >>> output = m(x)
-        >>> print([(k, v.shape) for k, v in output.items()])
+        >>> print([v.shape for v in output])
         >>> # returns
-        >>>   [('feat0', torch.Size([1, 128, 52, 44])),
-        >>>    ('feat2', torch.Size([1, 256, 26, 22])),
-        >>>    ('feat3', torch.Size([1, 512, 13, 11]))]
+        >>>   [torch.Size([1, 128, 52, 44]),
+        >>>    torch.Size([1, 256, 26, 22]),
+        >>>    torch.Size([1, 512, 13, 11])]
 
     """
     def __init__(
@@ -85,78 +86,60 @@ class PathAggregationNetwork(nn.Module):
             elif isinstance(m, (nn.Hardswish, nn.LeakyReLU, nn.ReLU, nn.ReLU6)):
                 m.inplace = True
 
-    def get_result_from_inner_blocks(self, x: Tensor, idx: int) -> Tensor:
-        """
-        This is equivalent to self.inner_blocks[idx](x),
-        but torchscript doesn't support this yet
-        """
-        num_blocks = len(self.inner_blocks)
-        if idx < 0:
-            idx += num_blocks
-        i = 0
-        out = x
-        for module in self.inner_blocks:
-            if i == idx:
-                out = module(x)
-            i += 1
-        return out
-
-    def get_result_from_layer_blocks(self, x: Tensor, idx: int) -> Tensor:
-        """
-        This is equivalent to self.layer_blocks[idx](x),
-        but torchscript doesn't support this yet
-        """
-        num_blocks = len(self.layer_blocks)
-        if idx < 0:
-            idx += num_blocks
-        i = 0
-        out = x
-        for module in self.layer_blocks:
-            if i == idx:
-                out = module(x)
-            i += 1
-        return out
-
-    def forward(self, x: Dict[str, Tensor]) -> List[Tensor]:
+    def forward(self, x: List[Tensor]) -> List[Tensor]:
         """
         Computes the PAN for a set of feature maps.
 
         Args:
-            x (OrderedDict[Tensor]): feature maps for each feature level.
+            x (list[Tensor]): feature maps for each feature level, ordered from
+                highest resolution first.
 
         Returns:
-            results (OrderedDict[Tensor]): feature maps after PAN layers.
+            results (list[Tensor]): feature maps after PAN layers.
                 They are ordered from highest resolution first.
         """
-        # unpack OrderedDict into two lists for easier handling
-        x = list(x.values())
-
-        # Descending the feature pyramid
-        inners = []
-        last_inner = self.get_result_from_inner_blocks(x[2], 0)
-        last_inner = self.get_result_from_inner_blocks(last_inner, 1)
-        inners.append(last_inner)
-        last_inner = self.get_result_from_inner_blocks(last_inner, 2)
-        last_inner = torch.cat([last_inner, x[1]], dim=1)
-        last_inner = self.get_result_from_inner_blocks(last_inner, 3)
-        last_inner = self.get_result_from_inner_blocks(last_inner, 4)
-        inners.insert(0, last_inner)
-        last_inner = self.get_result_from_inner_blocks(last_inner, 5)
-        last_inner = torch.cat([last_inner, x[0]], dim=1)
-        inners.insert(0, last_inner)
+        # The upsampling doesn't preserve the channels_last memory format, keep the upsampled
+        # feature maps in the format of the inputs, so that the concatenations and the blocks
+        # behind them don't switch between layouts
+        if _is_channels_last(x[0]):
+            memory_format = torch.channels_last
+        else:
+            memory_format = torch.contiguous_format
+
+        # Descending the feature pyramid, the number of feature levels is fixed to 3,
+        # so the blocks are called by constant index to keep the graph free of loops
+        inner_2 = self.inner_blocks[0](x[2])
+        inner_2 = self.inner_blocks[1](inner_2)
+        last_inner = self.inner_blocks[2](inner_2)
+        last_inner = last_inner.contiguous(memory_format=memory_format)
+        last_inner = torch.cat((last_inner, x[1]), dim=1)
+        last_inner = self.inner_blocks[3](last_inner)
+        inner_1 = self.inner_blocks[4](last_inner)
+        last_inner = self.inner_blocks[5](inner_1)
+        last_inner = last_inner.contiguous(memory_format=memory_format)
+        inner_0 = torch.cat((last_inner, x[0]), dim=1)
 
         # Ascending the feature pyramid
-        results = []
-        last_inner = self.get_result_from_layer_blocks(inners[0], 0)
-        results.append(last_inner)
+        out_0 = self.layer_blocks[0](inner_0)
+
+        last_inner = self.layer_blocks[1](out_0)
+        last_inner = torch.cat((last_inner, inner_1), dim=1)
+        out_1 = self.layer_blocks[2](last_inner)
 
-        for idx in range(len(inners) - 1):
-            last_inner = self.get_result_from_layer_blocks(last_inner, 2 * idx + 1)
-            last_inner = torch.cat([last_inner, inners[idx + 1]], dim=1)
-            last_inner = self.get_result_from_layer_blocks(last_inner, 2 * idx + 2)
-            results.append(last_inner)
+        last_inner = self.layer_blocks[3](out_1)
+        last_inner = torch.cat((last_inner, inner_2), dim=1)
+        out_2 = self.layer_blocks[4](last_inner)
 
-        return results
+        return [out_0, out_1, out_2]
+
+
+def _is_channels_last(x: Tensor) -> bool:
+    """
+    Scriptable version of ``x.is_contiguous(memory_format=torch.channels_last)``,
+    TorchScript doesn't support the ``memory_format`` argument of ``is_contiguous`` yet
+    """
+    _, num_channels, height, width = x.shape
+    return num_channels > 1 and height * width > 1 and x.stride(1) == 1
 
 
 _block = {
@@ -6,7 +6,6 @@ from torch import nn, Tensor
 import torch.nn.functional as F
 
 import torchvision
-from torchvision.ops import box_convert
 
 from typing import Dict, Optional, List, Tuple
 
@@ -44,6 +43,9 @@ class YOLOTransform(nn.Module):
         - input normalization (mean subtraction and std division)
         - input / target resizing to match min_size / max_size
 
+    The images can be either float tensors in [0, 1] or uint8 tensors in [0, 255], the
+    latter are scaled to [0, 1] after resizing.
+
     It returns a ImageList for the inputs, and a List[Dict[Tensor]] for the targets
     """
     def __init__(
@@ -82,38 +84,56 @@ class YOLOTransform(nn.Module):
                 targets_copy.append(data)
             targets = targets_copy
 
-        for i in range(len(images)):
-            image = images[i]
-            target_index = targets[i] if targets is not None else None
-
+        for image in images:
             if image.dim() != 3:
                 raise ValueError("images is expected to be a list of 3d tensors "
                                  "of shape [C, H, W], got {}".format(image.shape))
 
-            image, target_index = self.resize(image, target_index)
-            images[i] = image
-            if targets is not None and target_index is not None:
-                targets[i] = target_index
+        if not torchvision._is_tracing() and self._can_batch_resize(images, targets):
+            # Images of the same shape share the resizing parameters and are written
+            # directly into the padded batch
+            samples, image_size, targets = self.batched_resize(images, targets)
+            image_sizes = [image_size for _ in range(len(images))]
+        else:
+            for i in range(len(images)):
+                image = images[i]
+                target_index = targets[i] if targets is not None else None
+
+                image, target_index = self.resize(image, target_index)
+                images[i] = image
+                if targets is not None and target_index is not None:
+                    targets[i] = target_index
+
+            image_sizes = [img.shape[-2:] for img in images]
+            samples = nested_tensor_from_tensor_list(images)
 
-        image_sizes = [img.shape[-2:] for img in images]
-        images = nested_tensor_from_tensor_list(images)
         image_sizes_list: List[Tuple[int, int]] = []
         for image_size in image_sizes:
             assert len(image_size) == 2
             image_sizes_list.append((image_size[0], image_size[1]))
 
-        image_list = NestedTensor(images, image_sizes_list)
+        image_list = NestedTensor(samples, image_sizes_list)
 
         if targets is not None:
-            targets_batched = []
+            # Gather the targets of all images first, then fill each column of
+            # the batched targets [image_id, label, cx, cy, w, h] in one go
+            image_ids: List[Tensor] = []
+            labels: List[Tensor] = []
+            boxes: List[Tensor] = []
+            num_objects_total = 0
             for i, target in enumerate(targets):
                 num_objects = len(target['labels'])
                 if num_objects > 0:
-                    targets_merged = torch.full((num_objects, 6), i, dtype=torch.float32, device=device)
-                    targets_merged[:, 1] = target['labels']
-                    targets_merged[:, 2:] = target['boxes']
-                    targets_batched.append(targets_merged)
-            targets_batched = torch.cat(targets_batched, dim=0)
+                    image_ids.append(torch.full((num_objects,), i, dtype=torch.float32, device=device))
+                    labels.append(target['labels'])
+                    boxes.append(target['boxes'])
+                    num_objects_total += num_objects
+
+            targets_batched = torch.empty((num_objects_total, 6), dtype=torch.float32, device=device)
+            if num_objects_total > 0:
+                targets_batched[:, 0] = torch.cat(image_ids, dim=0)
+                targets_batched[:, 1] = torch.cat(labels, dim=0)
+                targets_batched[:, 2:] = torch.cat(boxes, dim=0)
         else:
             targets_batched = None
 
@@ -152,6 +172,79 @@ class YOLOTransform(nn.Module):
 
         return image, target
 
+    def _can_batch_resize(
+        self,
+        images: List[Tensor],
+        targets: Optional[List[Dict[str, Tensor]]] = None,
+    ) -> bool:
+        """
+        Check whether all images can share the resizing parameters and one padded batch,
+        that is they have the same shape, dtype and device, and are resized to the same scale.
+        """
+        if self.training and len(self.min_size) > 1:
+            # A random scale is chosen for each image
+            return False
+
+        image_shape = images[0].shape
+        image_dtype = images[0].dtype
+        image_device = images[0].device
+        for image in images[1:]:
+            if image.shape != image_shape:
+                return False
+            # Mixing uint8 and float images, only the uint8 ones are scaled to [0, 1].
+            # Note that TorchScript only supports ``==`` for devices
+            if image.dtype != image_dtype or not image.device == image_device:
+                return False
+
+        if targets is not None:
+            for target in targets:
+                if "masks" in target:
+                    return False
+
+        return True
+
+    def batched_resize(
+        self,
+        images: List[Tensor],
+        targets: Optional[List[Dict[str, Tensor]]] = None,
+        size_divisible: int = 32,
+    ) -> Tuple[Tensor, List[int], Optional[List[Dict[str, Tensor]]]]:
+        """
+        Resize a list of images of the same shape and batch them, the resizing parameters
+        are computed once, and each image is written directly into the padded batch.
+        The images are not stacked beforehand, as that would copy them at full resolution.
+
+        Returns:
+            the padded batch, the size of the resized images and the targets
+        """
+        h, w = images[0].shape[-2:]
+        # All images share the same scale, see _can_batch_resize
+        min_size = float(self.min_size[-1])
+
+        size, scale_factor, recompute_scale_factor = _get_resize_params(
+            images[0], min_size, float(self.max_size), self.fixed_size)
+
+        image = _interpolate_image(images[0], size, scale_factor, recompute_scale_factor)
+        num_channels, height, width = image.shape
+
+        stride = float(size_divisible)
+        padded_height = int(math.ceil(float(height) / stride) * stride)
+        padded_width = int(math.ceil(float(width) / stride) * stride)
+        # Most of the batch is overwritten by the images, so only the padded borders are filled
+        samples = image.new_empty([len(images), num_channels, padded_height, padded_width])
+        samples[:, :, height:, :].zero_()
+        samples[:, :, :height, width:].zero_()
+        samples[0, :, :height, :width].copy_(image)
+        for i in range(1, len(images)):
+            image = _interpolate_image(images[i], size, scale_factor, recompute_scale_factor)
+            samples[i, :, :height, :width].copy_(image)
+
+        if targets is not None:
+            for target in targets:
+                target["boxes"] = normalize_boxes(target["boxes"], (h, w))
+
+        return samples, [height, width], targets
+
     def postprocess(
         self,
         result: List[Dict[str, Tensor]],
@@ -182,16 +275,21 @@ def nested_tensor_from_tensor_list(tensor_list: List[Tensor], size_divisible: in
         max_size[2] = int(math.ceil(float(max_size[2]) / stride) * stride)
 
         batch_shape = [len(tensor_list)] + max_size
-        tensor_batched = tensor_list[0].new_full(batch_shape, 0)
+        # Most of the batch is overwritten by the images, so only the padded borders are filled
+        tensor_batched = tensor_list[0].new_empty(batch_shape)
         for img, pad_img in zip(tensor_list, tensor_batched):
             pad_img[: img.shape[0], : img.shape[1], : img.shape[2]].copy_(img)
+            pad_img[img.shape[0]:].zero_()
+            pad_img[:, img.shape[1]:, :].zero_()
+            pad_img[:, : img.shape[1], img.shape[2]:].zero_()
     else:
         raise ValueError('not supported')
     return tensor_batched
 
 
 def _max_by_axis(the_list: List[List[int]]) -> List[int]:
-    maxes = the_list[0]
+    # Copy the first sizes, so that the input lists are left untouched
+    maxes = list(the_list[0])
     for sublist in the_list[1:]:
         for index, item in enumerate(sublist):
             maxes[index] = max(maxes[index], item)
@@ -239,39 +337,78 @@ def _fake_cast_onnx(v: Tensor) -> float:
     return v
 
 
-def _resize_image_and_masks(
+def _get_resize_params(
     image: Tensor,
     self_min_size: float,
     self_max_size: float,
     fixed_size: Optional[Tuple[int, int]] = None,
-    target: Optional[Dict[str, Tensor]] = None,
-) -> Tuple[Tensor, Optional[Dict[str, Tensor]]]:
+) -> Tuple[Optional[List[int]], Optional[float], Optional[bool]]:
     """
-    Resize the image and its targets
+    Get the ``size``, ``scale_factor`` and ``recompute_scale_factor`` arguments
+    of ``F.interpolate`` used to resize the image
     """
-    if torchvision._is_tracing():
-        im_shape = _get_shape_onnx(image)
-    else:
-        im_shape = torch.tensor(image.shape[-2:])
-
     size: Optional[List[int]] = None
     scale_factor: Optional[float] = None
     recompute_scale_factor: Optional[bool] = None
     if fixed_size is not None:
         size = [fixed_size[1], fixed_size[0]]
     else:
-        min_size = torch.min(im_shape).to(dtype=torch.float32)
-        max_size = torch.max(im_shape).to(dtype=torch.float32)
-        scale = torch.min(self_min_size / min_size, self_max_size / max_size)
-
         if torchvision._is_tracing():
+            # The shape is dynamic in the exported graph, so the scale is computed with tensors,
+            # in float64 as the eager scale
+            im_shape = _get_shape_onnx(image)
+            min_size = torch.min(im_shape).to(dtype=torch.float64)
+            max_size = torch.max(im_shape).to(dtype=torch.float64)
+            scale = torch.min(self_min_size / min_size, self_max_size / max_size)
             scale_factor = _fake_cast_onnx(scale)
+            recompute_scale_factor = True
         else:
-            scale_factor = scale.item()
-        recompute_scale_factor = True
+            h, w = image.shape[-2:]
+            scale = min(self_min_size / min(h, w), self_max_size / max(h, w))
+            # The traced ``F.interpolate`` floors the float32 product of the shape and
+            # the scale, the same output size is computed here to match the exported graph
+            new_size = torch.floor(torch.tensor([h, w], dtype=torch.float32) *
+                                   torch.tensor(scale, dtype=torch.float32))
+            size = [int(new_size[0]), int(new_size[1])]
+
+    return size, scale_factor, recompute_scale_factor
 
+
+def _interpolate_image(
+    image: Tensor,
+    size: Optional[List[int]],
+    scale_factor: Optional[float],
+    recompute_scale_factor: Optional[bool],
+) -> Tensor:
+    """
+    Bilinear resizing of a ``[C, H, W]`` image, uint8 images are scaled to [0, 1]
+    """
+    is_uint8 = image.dtype == torch.uint8
+    if is_uint8:
+        # The bilinear interpolation doesn't support uint8, and the scaling to [0, 1]
+        # is done in-place on the resized image
+        image = image.float()
     image = F.interpolate(image[None], size=size, scale_factor=scale_factor, mode='bilinear',
                           recompute_scale_factor=recompute_scale_factor, align_corners=False)[0]
+    if is_uint8:
+        image = image.div_(255.)
+    return image
+
+
+def _resize_image_and_masks(
+    image: Tensor,
+    self_min_size: float,
+    self_max_size: float,
+    fixed_size: Optional[Tuple[int, int]] = None,
+    target: Optional[Dict[str, Tensor]] = None,
+) -> Tuple[Tensor, Optional[Dict[str, Tensor]]]:
+    """
+    Resize the image and its targets
+    """
+    size, scale_factor, recompute_scale_factor = _get_resize_params(
+        image, self_min_size, self_max_size, fixed_size)
+
+    image = _interpolate_image(image, size, scale_factor, recompute_scale_factor)
 
     if target is None:
         return image, target
@@ -285,30 +422,48 @@ def _resize_image_and_masks(
 
 
 def resize_boxes(boxes: Tensor, original_size: List[int], new_size: List[int]) -> Tensor:
-    ratios = [
-        torch.tensor(s, dtype=torch.float32, device=boxes.device) /
-        torch.tensor(s_orig, dtype=torch.float32, device=boxes.device)
-        for s, s_orig in zip(new_size, original_size)
-    ]
-    ratio_height, ratio_width = ratios
-    xmin, ymin, xmax, ymax = boxes.unbind(1)
-
-    xmin = xmin * ratio_width
-    xmax = xmax * ratio_width
-    ymin = ymin * ratio_height
-    ymax = ymax * ratio_height
-    return torch.stack((xmin, ymin, xmax, ymax), dim=1)
+    if torchvision._is_tracing():
+        # The sizes are dynamic in the traced graph, so the ratios must stay tensors
+        ratios = [torch.tensor(s, dtype=torch.float32, device=boxes.device) /
+                  torch.tensor(s_orig, dtype=torch.float32, device=boxes.device)
+                  for s, s_orig in zip(new_size, original_size)]
+        ratio_height, ratio_width = ratios
+        scale_factors = _box_scale_factors_onnx(boxes, ratio_width, ratio_height)
+    else:
+        ratio_height = float(new_size[0]) / float(original_size[0])
+        ratio_width = float(new_size[1]) / float(original_size[1])
+        scale_factors = _box_scale_factors(boxes, ratio_width, ratio_height)
+    return boxes * scale_factors
 
 
 def normalize_boxes(boxes: Tensor, original_size: List[int]) -> Tensor:
-    height = torch.tensor(original_size[0], dtype=torch.float32, device=boxes.device)
-    width = torch.tensor(original_size[1], dtype=torch.float32, device=boxes.device)
-    xmin, ymin, xmax, ymax = boxes.unbind(1)
-
-    xmin = xmin / width
-    xmax = xmax / width
-    ymin = ymin / height
-    ymax = ymax / height
-    boxes = torch.stack((xmin, ymin, xmax, ymax), dim=1)
-    # Convert xyxy to cxcywh
-    return box_convert(boxes, in_fmt='xyxy', out_fmt='cxcywh')
+    if torchvision._is_tracing():
+        # The sizes are dynamic in the traced graph, so they must stay tensors
+        height = torch.tensor(original_size[0], dtype=torch.float32, device=boxes.device)
+        width = torch.tensor(original_size[1], dtype=torch.float32, device=boxes.device)
+        scale_factors = _box_scale_factors_onnx(boxes, width, height)
+    else:
+        scale_factors = _box_scale_factors(boxes, float(original_size[1]), float(original_size[0]))
+    xmin, ymin, xmax, ymax = (boxes / scale_factors).unbind(1)
+    # Convert xyxy to cxcywh directly, and stack the coordinates only once
+    cx = (xmin + xmax) * 0.5
+    cy = (ymin + ymax) * 0.5
+    w = xmax - xmin
+    h = ymax - ymin
+    return torch.stack((cx, cy, w, h), dim=1)
+
+
+def _box_scale_factors(boxes: Tensor, scale_width: float, scale_height: float) -> Tensor:
+    """
+    Build the ``[w, h, w, h]`` factors used to scale the boxes in a single broadcasted op
+    """
+    dtype = boxes.dtype if boxes.is_floating_point() else torch.float32
+    return torch.tensor([scale_width, scale_height, scale_width, scale_height], dtype=dtype, device=boxes.device)
+
+
+def _box_scale_factors_onnx(boxes: Tensor, scale_width: Tensor, scale_height: Tensor) -> Tensor:
+    """
+    Build the ``[w, h, w, h]`` factors from the tensor sizes, so that they stay dynamic in the traced graph
+    """
+    dtype = boxes.dtype if boxes.is_floating_point() else torch.float32
+    return torch.stack((scale_width, scale_height)).repeat(2).to(dtype=dtype)
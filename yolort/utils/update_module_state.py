@@ -1,5 +1,6 @@
 # Copyright (c) 2020, Zhiqiang Wang. All Rights Reserved.
-from functools import reduce
+from collections import OrderedDict
+from functools import partial
 import torch
 from torch import nn
 
@@ -7,6 +8,21 @@ from ..models import yolo
 
 from typing import Any, Union, Optional
 
+# The supported ultralytics models and their yolort counterparts
+_ARCHITECTURE_MAPS = {
+    'yolov5s_pan_v3.1': 'yolov5_darknet_pan_s_r31',
+    'yolov5m_pan_v3.1': 'yolov5_darknet_pan_m_r31',
+    'yolov5l_pan_v3.1': 'yolov5_darknet_pan_l_r31',
+    'yolov5s_pan_v4.0': 'yolov5_darknet_pan_s_r40',
+    'yolov5m_pan_v4.0': 'yolov5_darknet_pan_m_r40',
+    'yolov5l_pan_v4.0': 'yolov5_darknet_pan_l_r40',
+    'yolov5s_tan_v4.0': 'yolov5_darknet_tan_s_r40',
+}
+
+# Indices of the PAN blocks of yolort in the ultralytics sequential model
+_INNER_BLOCK_MAPS = {'0': 9, '1': 10, '3': 13, '4': 14}
+_LAYER_BLOCK_MAPS = {'0': 17, '1': 18, '2': 20, '3': 21, '4': 23}
+
 
 def update_module_state_from_ultralytics(
     arch: str = 'yolov5s',
@@ -15,6 +31,7 @@ def update_module_state_from_ultralytics(
     num_classes: int = 80,
     custom_path_or_model: Optional[Union[str, dict, nn.Module]] = None,
     set_fp16: bool = True,
+    alias: bool = False,
     **kwargs: Any,
 ):
     """
@@ -44,34 +61,36 @@ def update_module_state_from_ultralytics(
             Default: None.
         set_fp16 (bool): allow selective conversion to fp16 or not.
             Default: True.
+        alias (bool): share the memory of the ultralytics weights rather than copying them,
+            it can't be combined with ``set_fp16``, which allocates new weights anyway.
+            Default: False.
     """
-    architecture_maps = {
-        'yolov5s_pan_v3.1': 'yolov5_darknet_pan_s_r31',
-        'yolov5m_pan_v3.1': 'yolov5_darknet_pan_m_r31',
-        'yolov5l_pan_v3.1': 'yolov5_darknet_pan_l_r31',
-        'yolov5s_pan_v4.0': 'yolov5_darknet_pan_s_r40',
-        'yolov5m_pan_v4.0': 'yolov5_darknet_pan_m_r40',
-        'yolov5l_pan_v4.0': 'yolov5_darknet_pan_l_r40',
-        'yolov5s_tan_v4.0': 'yolov5_darknet_tan_s_r40',
-    }
-
-    if custom_path_or_model is None:
-        model = torch.hub.load(f'ultralytics/yolov5:{version}', arch, pretrained=True)
-    else:
-        model = torch.hub.load(f'ultralytics/yolov5:{version}', 'custom', path_or_model=custom_path_or_model)
+    # Check the arguments before loading, which may download the ultralytics model
+    if alias and set_fp16:
+        raise ValueError("The weights can't be aliased when converting them to fp16, "
+                         "set either alias or set_fp16 to False")
 
     key_arch = f'{arch}_{feature_fusion_type.lower()}_{version}'
-    if key_arch not in architecture_maps:
+    if key_arch not in _ARCHITECTURE_MAPS:
         raise ValueError("Currently does't supports this architecture, "
                          "fell free to file an issue labeled enhancement to us")
 
+    hub_repo = f'ultralytics/yolov5:{version}'
+    if custom_path_or_model is None:
+        model = torch.hub.load(hub_repo, arch, pretrained=True)
+    else:
+        model = torch.hub.load(hub_repo, 'custom', path_or_model=custom_path_or_model)
+
     module_state_updater = ModuleStateUpdate(
-        arch=architecture_maps[key_arch],
+        arch=_ARCHITECTURE_MAPS[key_arch],
         num_classes=num_classes,
         **kwargs,
     )
 
-    module_state_updater.updating(model)
+    module_state_updater.updating(model, alias=alias)
+    # The yolort model holds the weights now, release the ultralytics model
+    # before casting, so that both models don't stay resident at the same time
+    del model
 
     if set_fp16:
         module_state_updater.model.half()
@@ -87,68 +106,108 @@ class ModuleStateUpdate:
         self,
         arch: str = 'yolov5_darknet_pan_s_r31',
         num_classes: int = 80,
-        inner_block_maps: dict = {'0': '9', '1': '10', '3': '13', '4': '14'},
-        layer_block_maps: dict = {'0': '17', '1': '18', '2': '20', '3': '21', '4': '23'},
+        inner_block_maps: dict = _INNER_BLOCK_MAPS,
+        layer_block_maps: dict = _LAYER_BLOCK_MAPS,
         head_ind: int = 24,
         head_name: str = 'm',
     ) -> None:
         # Configuration for making the keys consistent
-        self.inner_block_maps = inner_block_maps
-        self.layer_block_maps = layer_block_maps
+        # The indices are converted once here, rather than for every key to resolve
+        self.inner_block_maps = {k: int(v) for k, v in inner_block_maps.items()}
+        self.layer_block_maps = {k: int(v) for k, v in layer_block_maps.items()}
         self.head_ind = head_ind
         self.head_name = head_name
         # Set model
         self.model = yolo.__dict__[arch](num_classes=num_classes)
+        # Where to find each parameter and buffer of the model in the ultralytics model
+        self._state_plan = self._build_state_plan()
 
-    def updating(self, state_dict):
+    @torch.no_grad()
+    def updating(self, state_dict, alias: bool = False):
         # Obtain module state
         state_dict = obtain_module_sequential(state_dict)
+        # Flatten the states of the ultralytics model once, the keys of each
+        # parameter or buffer are then resolved with plain dict lookups
+        state_dict = flatten_module_states(state_dict)
+        target_state_dict = self._build_target_state_dict(state_dict)
+        if alias:
+            self._alias_state_dict(target_state_dict)
+        else:
+            # Load all the parameters and buffers in one go
+            self.model.load_state_dict(target_state_dict)
+
+    def _alias_state_dict(self, target_state_dict):
+        """
+        Make the parameters and buffers of the model share the memory of the ultralytics model
+        """
+        model_state_dict = self.model.state_dict(keep_vars=True)
+
+        # Validate all the shapes before touching the model, and report the mismatches
+        # in the same way as load_state_dict
+        error_msgs = []
+        for name, source in target_state_dict.items():
+            if source.shape != model_state_dict[name].shape:
+                error_msgs.append(f'size mismatch for {name}: copying a param with shape {source.shape}, '
+                                  f'the shape in current model is {model_state_dict[name].shape}.')
+        if len(error_msgs) > 0:
+            raise RuntimeError('Error(s) in aliasing state_dict for {}:\n\t{}'.format(
+                self.model.__class__.__name__, '\n\t'.join(error_msgs)))
+
+        for name, source in target_state_dict.items():
+            tensor = model_state_dict[name]
+            if tensor.dtype == source.dtype and tensor.device == source.device:
+                tensor.data = source.data
+            else:
+                # The memory can't be shared across dtypes or devices
+                tensor.copy_(source)
+
+    def _build_target_state_dict(self, state_dict):
+        """
+        Collect the parameters and buffers of the ultralytics model with the keys of yolort
+        """
+        target_state_dict = OrderedDict()
+        for name, ind, key in self._state_plan:
+            target_state_dict[name] = state_dict[ind][key]
+
+        return target_state_dict
+
+    def _build_state_plan(self):
+        """
+        Locate the parameters and buffers of yolort in the ultralytics model. It only depends
+        on the architecture, so the keys are split once here rather than in every updating.
+        """
+        # Each submodule is bound to its own locator, so that there is no branching on the
+        # block maps for every key
+        submodules = [
+            ('backbone.body', self.model.backbone.body, self.locate_parameters_block),
+            ('backbone.pan.inner_blocks', self.model.backbone.pan.inner_blocks,
+             partial(self.locate_parameters_mapped_block, block_maps=self.inner_block_maps)),
+            ('backbone.pan.layer_blocks', self.model.backbone.pan.layer_blocks,
+             partial(self.locate_parameters_mapped_block, block_maps=self.layer_block_maps)),
+            ('head', self.model.head, self.locate_parameters_heads),
+        ]
+
+        state_plan = []
+        for prefix, submodule, locate_parameters in submodules:
+            # The parameters and buffers of each submodule are collected in one traversal
+            for name in submodule.state_dict(keep_vars=True):
+                state_plan.append((f'{prefix}.{name}', *locate_parameters(name)))
+
+        return state_plan
 
-        # Update backbone features
-        for name, params in self.model.backbone.body.named_parameters():
-            params.data.copy_(
-                self.attach_parameters_block(state_dict, name, None))
-
-        for name, buffers in self.model.backbone.body.named_buffers():
-            buffers.copy_(
-                self.attach_parameters_block(state_dict, name, None))
-
-        # Update PAN features
-        for name, params in self.model.backbone.pan.inner_blocks.named_parameters():
-            params.data.copy_(
-                self.attach_parameters_block(state_dict, name, self.inner_block_maps))
-
-        for name, buffers in self.model.backbone.pan.inner_blocks.named_buffers():
-            buffers.copy_(
-                self.attach_parameters_block(state_dict, name, self.inner_block_maps))
-
-        for name, params in self.model.backbone.pan.layer_blocks.named_parameters():
-            params.data.copy_(
-                self.attach_parameters_block(state_dict, name, self.layer_block_maps))
-
-        for name, buffers in self.model.backbone.pan.layer_blocks.named_buffers():
-            buffers.copy_(
-                self.attach_parameters_block(state_dict, name, self.layer_block_maps))
-
-        # Update box heads
-        for name, params in self.model.head.named_parameters():
-            params.data.copy_(
-                self.attach_parameters_heads(state_dict, name))
-
-        for name, buffers in self.model.head.named_buffers():
-            buffers.copy_(
-                self.attach_parameters_heads(state_dict, name))
+    @staticmethod
+    def locate_parameters_block(name):
+        ind, key = name.split('.', 1)
+        return int(ind), key
 
     @staticmethod
-    def attach_parameters_block(state_dict, name, block_maps=None):
-        keys = name.split('.')
-        ind = int(block_maps[keys[0]]) if block_maps else int(keys[0])
-        return rgetattr(state_dict[ind], keys[1:])
+    def locate_parameters_mapped_block(name, block_maps):
+        ind, key = name.split('.', 1)
+        return block_maps[ind], key
 
-    def attach_parameters_heads(self, state_dict, name):
-        keys = name.split('.')
-        ind = int(keys[1])
-        return rgetattr(getattr(state_dict[self.head_ind], self.head_name)[ind], keys[2:])
+    def locate_parameters_heads(self, name):
+        _, key = name.split('.', 1)
+        return self.head_ind, f'{self.head_name}.{key}'
 
 
 def rgetattr(obj, attr, *args):
@@ -156,13 +215,24 @@ def rgetattr(obj, attr, *args):
     Nested version of getattr.
     See <https://stackoverflow.com/questions/31174295/getattr-and-setattr-on-nested-objects>
     """
-    def _getattr(obj, attr):
-        return getattr(obj, attr, *args)
-    return reduce(_getattr, [obj] + attr)
+    for name in attr:
+        obj = getattr(obj, name, *args)
+    return obj
+
+
+def flatten_module_states(module):
+    """
+    Group the state of a sequential module by the index of its submodules, the parameters
+    and buffers of each submodule are keyed by their names inside that submodule
+    """
+    flat_states = {}
+    for name, tensor in module.state_dict(keep_vars=True).items():
+        ind, key = name.split('.', 1)
+        flat_states.setdefault(int(ind), {})[key] = tensor
+    return flat_states
 
 
 def obtain_module_sequential(state_dict):
-    if isinstance(state_dict, nn.Sequential):
-        return state_dict
-    else:
-        return obtain_module_sequential(state_dict.model)
+    while not isinstance(state_dict, nn.Sequential):
+        state_dict = state_dict.model
+    return state_dict